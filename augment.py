@@ -6,7 +6,9 @@ from scipy.ndimage.filters import gaussian_filter
 import torchvision.transforms.functional as F
 from io import BytesIO
 import torch
+import torch.nn as nn
 import torchvision.transforms as transforms
+from torchvision.transforms import v2
 
 import warnings
 warnings.filterwarnings("ignore", category=UserWarning)
@@ -79,4 +81,41 @@ class ImageAugmentor:
 
     def custom_resize(self, img):
         interp = self.sample_discrete(self.opt['rz_interp'])
-        return F.resize(img, self.opt['loadSize'], interpolation=self.rz_dict[interp])
\ No newline at end of file
+        return F.resize(img, self.opt['loadSize'], interpolation=self.rz_dict[interp])
+
+
+class GPUAugment(nn.Module):
+    """Batched augmentation executed on the GPU after the batch is moved to device.
+
+    The DataLoader workers only decode, resize, JPEG-augment and convert
+    images to tensors (see base_augment); crop/flip/blur and the mask (a
+    batched module from mask_gpu) are applied here once per (N,C,H,W) batch,
+    so the FFT and filtering cost is amortized across the batch instead of
+    paid per sample on the CPU.
+    """
+
+    def __init__(self, opt, mask=None, crop_size=224,
+                 mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225), train=True):
+        super().__init__()
+        self.mask = mask
+
+        sig = opt['blur_sig']
+        sigma = (max(sig[0], 0.1), sig[1]) if len(sig) == 2 else max(sig[0], 0.1)
+        self.blur = v2.RandomApply([v2.GaussianBlur(kernel_size=9, sigma=sigma)], p=opt['blur_prob'])
+
+        if train:
+            self.crop = v2.RandomResizedCrop(crop_size, antialias=True)
+            self.flip = v2.RandomHorizontalFlip()
+        else:
+            self.crop = v2.CenterCrop(crop_size)
+            self.flip = nn.Identity()
+
+        self.normalize = v2.Normalize(mean=list(mean), std=list(std))
+
+    def forward(self, x):
+        if self.mask is not None:
+            x = self.mask(x)
+        x = self.blur(x)
+        x = self.crop(x)
+        x = self.flip(x)
+        return self.normalize(x)
\ No newline at end of file
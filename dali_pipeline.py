@@ -0,0 +1,112 @@
+"""NVIDIA DALI loader: GPU-side JPEG decode + resize for training.
+
+nvJPEG decodes batches directly on the GPU and NPP handles the resize, so
+raw pixels never cross PCIe. The loader yields (images, labels) batches like
+a DataLoader and leaves mask/blur/crop/normalize to GPUAugment, matching the
+base_augment (Resize + JPEG re-compression + ToTensor) pipeline of the
+PyTorch path; the JPEG augmentation runs here as
+fn.jpeg_compression_distortion instead of ImageAugmentor's CPU codecs.
+
+DALI is an optional dependency; train.py keeps --loader pytorch as the
+default when it is not installed.
+"""
+
+try:
+    from nvidia.dali import fn, types
+    from nvidia.dali.pipeline import pipeline_def
+    from nvidia.dali.plugin.pytorch import DALIGenericIterator, LastBatchPolicy
+except ImportError:
+    pipeline_def = None
+
+
+if pipeline_def is not None:
+
+    @pipeline_def(enable_conditionals=True)
+    def _image_pipeline(data_dir, load_size, training, shard_id, num_shards,
+                        jpg_prob, jpg_qual):
+        jpegs, labels = fn.readers.file(
+            file_root=data_dir,
+            random_shuffle=training,
+            shard_id=shard_id,
+            num_shards=num_shards,
+            name='Reader',
+        )
+        images = fn.decoders.image(jpegs, device='mixed', output_type=types.RGB)
+        images = fn.resize(images, resize_shorter=load_size)
+        # Mirror ImageAugmentor.data_augment's JPEG re-compression: re-encode
+        # a jpg_prob fraction of samples at a quality drawn from jpg_qual
+        # (a discrete choice, like sample_discrete on the CPU path)
+        if fn.random.coin_flip(probability=jpg_prob, dtype=types.BOOL):
+            quality = fn.random.uniform(values=list(jpg_qual), dtype=types.INT32)
+            images = fn.jpeg_compression_distortion(images, quality=quality)
+        # Only convert HWC uint8 -> CHW float in [0,1]; GPUAugment normalizes
+        images = fn.crop_mirror_normalize(
+            images,
+            dtype=types.FLOAT,
+            output_layout='CHW',
+            scale=1 / 255.,
+        )
+        return images, labels
+
+
+class _SizedDataset:
+    # Stands in for loader.dataset so len(loader.dataset) keeps working
+    def __init__(self, size):
+        self._size = size
+
+    def __len__(self):
+        return self._size
+
+
+class DALILoader:
+    """Wraps a DALI pipeline behind the (images, labels) loader interface."""
+
+    def __init__(self, pipeline, size):
+        self._iterator = DALIGenericIterator(
+            pipeline,
+            ['images', 'labels'],
+            reader_name='Reader',
+            last_batch_policy=LastBatchPolicy.PARTIAL,
+            auto_reset=True,
+        )
+        self.dataset = _SizedDataset(size)
+
+    def __len__(self):
+        return len(self._iterator)
+
+    def __iter__(self):
+        for batch in self._iterator:
+            yield batch[0]['images'], batch[0]['labels'].squeeze(-1)
+
+
+def create_dali_loader(
+    data_dir,
+    batch_size,
+    num_threads,
+    device_id,
+    load_size,
+    training=True,
+    shard_id=0,
+    num_shards=1,
+    seed=44,
+    prefetch_queue_depth=2,
+    jpg_prob=0.0,
+    jpg_qual=(30, 100),
+    ):
+
+    if pipeline_def is None:
+        raise ImportError("NVIDIA DALI is not installed; run with --loader pytorch")
+
+    # Keep prefetch_queue_depth small so the decode pipeline does not compete
+    # with training kernels for GPU memory
+    pipeline = _image_pipeline(
+        data_dir, load_size, training, shard_id, num_shards,
+        jpg_prob, jpg_qual,
+        batch_size=batch_size,
+        num_threads=num_threads,
+        device_id=device_id,
+        seed=seed,
+        prefetch_queue_depth=prefetch_queue_depth,
+    )
+    pipeline.build()
+    return DALILoader(pipeline, pipeline.epoch_size('Reader'))
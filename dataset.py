@@ -1,7 +1,7 @@
 import torch
 from torchvision.io import read_image
 from torchvision import transforms
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, IterableDataset, get_worker_info
 from typing import Any, Callable, Optional
 import os
 from PIL import Image
@@ -9,16 +9,109 @@ import numpy as np
 from tqdm import tqdm
 import random
 
+class RoundRobinIterable(IterableDataset):
+    """Round-robins individual samples across DataLoader workers.
+
+    The default DataLoader hands each batch's indices to a single worker, so
+    the first batch waits for one worker to decode the whole batch while the
+    others idle. This shards item-by-item over (rank, worker) instead.
+    Shuffling happens here, so no DistributedSampler is needed; use
+    persistent_workers=False so workers pick up set_epoch reshuffles.
+    """
+
+    def __init__(self, dataset, shuffle=True, seed=44, rank=0, world_size=1):
+        self.dataset = dataset
+        self.shuffle = shuffle
+        self.seed = seed
+        self.rank = rank
+        self.world_size = world_size
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        return len(self.dataset) // self.world_size
+
+    def __iter__(self):
+        worker_info = get_worker_info()
+        worker_id = worker_info.id if worker_info is not None else 0
+        num_workers = worker_info.num_workers if worker_info is not None else 1
+
+        if self.shuffle:
+            generator = torch.Generator()
+            generator.manual_seed(self.seed + self.epoch)
+            order = torch.randperm(len(self.dataset), generator=generator).tolist()
+        else:
+            order = list(range(len(self.dataset)))
+
+        # Shard across DDP ranks first, then round-robin across workers.
+        # Truncate every rank to the same length — otherwise the first
+        # len(dataset) % world_size ranks get one extra sample, run one more
+        # optimizer step than the rest and hang the gradient all-reduce
+        order = order[self.rank::self.world_size]
+        order = order[:len(self.dataset) // self.world_size]
+        for index in order[worker_id::num_workers]:
+            yield self.dataset[index]
+
+
 class ForenSynths(Dataset):
     def __init__(self, root_dir, transform=None):
         self.root_dir = root_dir
         self.transform = transform
         self.classes = ['0_real', '1_fake']
-        self.data = []
+
+        # The file index is cached as memory-mapped arrays so every DataLoader
+        # worker shares the same pages instead of duplicating a Python list of
+        # path tuples in each process
+        paths_file = os.path.join(root_dir, '_index_paths.npy')
+        labels_file = os.path.join(root_dir, '_index_labels.npy')
+
+        if self._cache_usable(paths_file, labels_file):
+            self.paths = np.load(paths_file, mmap_mode='r')
+            self.labels = np.load(labels_file, mmap_mode='r')
+            return
+
+        paths, labels = self._scan(root_dir)
+        self.paths = np.array(paths, dtype=np.bytes_)
+        self.labels = np.array(labels, dtype=np.int8)
+
+        # Datasets often live on read-only mounts; fall back to the in-memory
+        # arrays (still one flat fixed-width block, not a list of tuples)
+        # when the cache cannot be written
+        if os.access(root_dir, os.W_OK):
+            self._write_index(self.paths, paths_file)
+            self._write_index(self.labels, labels_file)
+            self.paths = np.load(paths_file, mmap_mode='r')
+            self.labels = np.load(labels_file, mmap_mode='r')
+
+    def _cache_usable(self, paths_file, labels_file):
+        if not (os.path.exists(paths_file) and os.path.exists(labels_file)):
+            return False
+
+        # Rebuild when any category/class directory changed after the index
+        # was written; directory mtimes move when files are added or removed
+        cache_mtime = min(os.path.getmtime(paths_file), os.path.getmtime(labels_file))
+        for category in os.listdir(self.root_dir):
+            category_path = os.path.join(self.root_dir, category)
+            if not os.path.isdir(category_path):
+                continue
+            if os.path.getmtime(category_path) > cache_mtime:
+                return False
+            for class_name in self.classes:
+                class_path = os.path.join(category_path, class_name)
+                if os.path.isdir(class_path) and os.path.getmtime(class_path) > cache_mtime:
+                    return False
+        return True
+
+    def _scan(self, root_dir):
+        paths, labels = [], []
 
         # Iterate over the categories
         for category in os.listdir(root_dir):
             category_path = os.path.join(root_dir, category)
+            if not os.path.isdir(category_path):
+                continue
 
             # Iterate over class names (real/fake)
             for class_name in self.classes:
@@ -26,16 +119,25 @@ class ForenSynths(Dataset):
 
                 # Iterate over files
                 for file_name in os.listdir(class_path):
-                    file_path = os.path.join(class_path, file_name)
+                    paths.append(os.path.join(class_path, file_name))
+                    labels.append(self.classes.index(class_name))
+
+        return paths, labels
 
-                    # Append a tuple (file_path, class_index)
-                    self.data.append((file_path, self.classes.index(class_name)))
+    def _write_index(self, array, target):
+        # Write through a temp file so concurrent ranks never read a partial
+        # index
+        tmp_file = f'{target}.tmp{os.getpid()}'
+        with open(tmp_file, 'wb') as f:
+            np.save(f, array)
+        os.replace(tmp_file, target)
 
     def __len__(self):
-        return len(self.data)
+        return len(self.paths)
 
     def __getitem__(self, index):
-        img_path, label = self.data[index]
+        img_path = self.paths[index].decode()
+        label = int(self.labels[index])
 
         # Load image
         image = Image.open(img_path).convert("RGB")
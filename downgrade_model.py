@@ -1,3 +1,4 @@
+import pickle
 import torch
 
 def convert_checkpoint_format(new_checkpoint_path, old_checkpoint_path):
@@ -8,8 +9,16 @@ def convert_checkpoint_format(new_checkpoint_path, old_checkpoint_path):
     - new_checkpoint_path (str): The path to the checkpoint file saved in the new format.
     - old_checkpoint_path (str): The path where the checkpoint will be saved in the old format.
     """
-    # Load the checkpoint in the new format
-    checkpoint = torch.load(new_checkpoint_path, map_location='cpu')
+    # Load the checkpoint in the new format; the mmap/weights_only kwargs
+    # need torch >= 2.1, and this script is exactly the kind of tool that
+    # gets run from an old environment. Older checkpoints also store numpy
+    # scalars that the weights-only unpickler rejects
+    try:
+        checkpoint = torch.load(new_checkpoint_path, map_location='cpu', mmap=True, weights_only=True)
+    except TypeError:
+        checkpoint = torch.load(new_checkpoint_path, map_location='cpu')
+    except pickle.UnpicklingError:
+        checkpoint = torch.load(new_checkpoint_path, map_location='cpu', mmap=True, weights_only=False)
     
     # Save the checkpoint in the old format
     torch.save(checkpoint, old_checkpoint_path, _use_new_zipfile_serialization=False)
@@ -28,7 +28,13 @@ class EarlyStopping:
         self.model_name = args.model_name
 
     def __call__(self, val_accuracy, model, optimizer, epoch):
-        score = val_accuracy
+        # accuracy_score returns a numpy scalar; keep best_score a plain
+        # float so weights-only checkpoint loads do not trip on numpy globals
+        score = float(val_accuracy)
+        # Under --compile the model arrives as an OptimizedModule whose state
+        # dict keys carry an _orig_mod. prefix; save the wrapped DDP module so
+        # checkpoints stay loadable without compilation
+        model = getattr(model, '_orig_mod', model)
         
         if self.early_stopping_enabled:
             if self.best_score is None:
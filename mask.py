@@ -1,5 +1,6 @@
 import torch
 import math
+from functools import lru_cache
 from torchvision.transforms import ToPILImage
 from PIL import Image, ImageDraw
 import numpy as np
@@ -98,6 +99,9 @@ class FrequencyMaskGenerator:
     def __init__(self, ratio: float = 0.3, band: str = 'all') -> None:
         self.ratio = ratio
         self.band = band  # 'low', 'mid', 'high', 'all'
+        # The band region only depends on the image size, so memoize it; the
+        # random frequency draw stays per-image
+        self._band_bounds = lru_cache(maxsize=8)(self._compute_band_bounds)
 
     def transform(self, image: Image.Image) -> Image.Image:
         image_array = np.array(image).astype(np.complex64)
@@ -111,9 +115,7 @@ class FrequencyMaskGenerator:
         masked_image = Image.fromarray(masked_image_array.astype(np.uint8))
         return masked_image
 
-    def _create_balanced_mask(self, height, width):
-        mask = np.ones((height, width, 3), dtype=np.complex64)
-
+    def _compute_band_bounds(self, height, width):
         # Determine the region of the frequency domain to mask
         if self.band == 'low':
             y_start, y_end = 0, height // 4
@@ -131,12 +133,21 @@ class FrequencyMaskGenerator:
             raise ValueError(f"Invalid band: {self.band}")
 
         num_frequencies = int(np.ceil((y_end - y_start) * (x_end - x_start) * self.ratio))
+        return y_start, y_end, x_start, x_end, num_frequencies
+
+    def _create_balanced_mask(self, height, width):
+        y_start, y_end, x_start, x_end, num_frequencies = self._band_bounds(height, width)
+
+        # A single-channel real mask broadcasts over the channel axis, so the
+        # (H,W,3) complex64 mask never needs to be materialized
+        mask = np.ones((height, width), dtype=np.float32)
+
         mask_frequencies_indices = np.random.permutation((y_end - y_start) * (x_end - x_start))[:num_frequencies]
         y_indices = mask_frequencies_indices // (x_end - x_start) + y_start
         x_indices = mask_frequencies_indices % (x_end - x_start) + x_start
 
-        mask[y_indices, x_indices, :] = 0
-        return mask
+        mask[y_indices, x_indices] = 0
+        return mask[:, :, np.newaxis]
 
 def test_mask_generator(
     image_path, 
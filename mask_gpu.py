@@ -0,0 +1,98 @@
+import math
+
+import torch
+import torch.nn as nn
+import torch.fft
+
+
+class PatchMaskGPU(nn.Module):
+    """Batched GPU version of mask.PatchMaskGenerator: zeroes a ratio of
+    square patches, with independent random patches per image in the batch."""
+
+    def __init__(self, ratio: float = 0.3) -> None:
+        super().__init__()
+        self.ratio = ratio
+
+    def forward(self, x):
+        batch_size, _, height, width = x.shape
+
+        # Compute the patch size
+        patch_size = 16
+        while height % patch_size != 0 or width % patch_size != 0:
+            patch_size -= 1
+
+        grid_h, grid_w = height // patch_size, width // patch_size
+        num_patches = grid_h * grid_w
+        mask_patches = int(math.ceil(num_patches * self.ratio))
+
+        # Randomly select patches to mask (per image)
+        scores = torch.rand(batch_size, num_patches, device=x.device)
+        indices = scores.topk(mask_patches, dim=1).indices
+        mask = torch.ones(batch_size, num_patches, device=x.device)
+        mask.scatter_(1, indices, 0.)
+
+        mask = mask.view(batch_size, 1, grid_h, grid_w)
+        mask = mask.repeat_interleave(patch_size, dim=2).repeat_interleave(patch_size, dim=3)
+        return x * mask
+
+
+class PixelMaskGPU(nn.Module):
+    """Batched GPU version of mask.PixelMaskGenerator: zeroes a ratio of
+    pixels, with an independent random mask per image in the batch."""
+
+    def __init__(self, ratio: float = 0.6) -> None:
+        super().__init__()
+        self.ratio = ratio
+
+    def forward(self, x):
+        batch_size, _, height, width = x.shape
+
+        pixel_count = height * width
+        mask_count = int(math.ceil(pixel_count * self.ratio))
+
+        scores = torch.rand(batch_size, pixel_count, device=x.device)
+        indices = scores.topk(mask_count, dim=1).indices
+        mask = torch.ones(batch_size, pixel_count, device=x.device)
+        mask.scatter_(1, indices, 0.)
+
+        return x * mask.view(batch_size, 1, height, width)
+
+
+class FrequencyMaskGPU(nn.Module):
+    """Batched GPU version of mask.FrequencyMaskGenerator: one fft2/ifft2
+    pair per (N,C,H,W) batch instead of one NumPy FFT per sample in the
+    DataLoader workers. The full (two-sided) spectrum is used so the band
+    windows land on the same frequencies as the CPU generator; on the rfft
+    half-spectrum the 'high' and 'mid' windows would fall partly or wholly
+    outside the kept columns."""
+
+    def __init__(self, ratio: float = 0.3, band: str = 'all') -> None:
+        super().__init__()
+        self.ratio = ratio
+        self.band = band  # 'low', 'mid', 'high', 'all'
+
+    def forward(self, x):
+        freq = torch.fft.fft2(x)
+        mask = self._band_mask(x.size(0), x.size(-2), x.size(-1), x.device)
+        return torch.fft.ifft2(freq * mask).real
+
+    def _band_mask(self, batch_size, height, width, device):
+        if self.band == 'low':
+            y_start, y_end = 0, height // 4
+            x_start, x_end = 0, width // 4
+        elif self.band == 'mid':
+            y_start, y_end = height // 4, 3 * height // 4
+            x_start, x_end = width // 4, 3 * width // 4
+        elif self.band == 'high':
+            y_start, y_end = 3 * height // 4, height
+            x_start, x_end = 3 * width // 4, width
+        elif self.band == 'all':
+            y_start, y_end = 0, height
+            x_start, x_end = 0, width
+        else:
+            raise ValueError(f"Invalid band: {self.band}")
+
+        mask = torch.ones(batch_size, 1, height, width, device=device)
+        keep = (torch.rand(batch_size, 1, y_end - y_start, x_end - x_start, device=device) >= self.ratio).float()
+        mask[:, :, y_start:y_end, x_start:x_end] = keep
+        return mask
@@ -23,6 +23,6 @@ class CLIPModel(nn.Module):
         if return_feature:
             return encoded  # Just return features if requested
         elif return_all:
-            return self.fc(encoded)  # Apply the linear layer and return
+            return self.fc(encoded.float())  # Apply the linear layer and return
         else:
-            return self.fc(encoded)  # Default to returning the final output
+            return self.fc(encoded.float())  # Default to returning the final output
@@ -0,0 +1,614 @@
+
+from contextlib import nullcontext
+
+import torch
+import torch.nn as nn
+from torch.nn.utils import prune
+from torch.utils.data import DataLoader
+from torchvision import transforms, datasets
+from tqdm import tqdm
+import numpy as np
+from sklearn.metrics import average_precision_score, accuracy_score
+import argparse
+
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data.distributed import DistributedSampler
+
+from augment import ImageAugmentor, GPUAugment
+from mask import *
+from mask_gpu import FrequencyMaskGPU, PixelMaskGPU, PatchMaskGPU
+from utils import *
+
+from networks.resnet import resnet50
+from networks.resnet_mod import resnet50 as _resnet50, ChannelLinear
+from networks.clip_models import CLIPModel
+import os
+os.environ['NCCL_BLOCKING_WAIT'] = '1'
+os.environ['NCCL_DEBUG'] = 'WARN'
+
+
+def apply_pruning(model, amount, global_prune=False):
+    # One round of L1 magnitude pruning over every conv/linear layer. Masks
+    # are folded into the weights after each round, so `amount` is the
+    # cumulative sparsity of the full weight tensor, not an increment.
+    if global_prune:
+        parameters_to_prune = [
+            (module, 'weight') for module in model.modules()
+            if isinstance(module, (nn.Conv2d, nn.Linear))
+        ]
+        prune.global_unstructured(
+            parameters_to_prune,
+            pruning_method=prune.L1Unstructured,
+            amount=amount,
+        )
+    else:
+        for module in model.modules():
+            if isinstance(module, (nn.Conv2d, nn.Linear)):
+                prune.l1_unstructured(module, name='weight', amount=amount)
+
+
+def apply_semi_structured_sparsity(model):
+    # Re-mask linear weights to the 2:4 pattern (keep the top-2 of every 4
+    # consecutive weights along the reduction dim) and hand them to the
+    # Ampere sparse Tensor Cores. Conv weights keep their unstructured masks:
+    # to_sparse_semi_structured only accepts 2D weights. The sparse kernels
+    # also require fp16/bf16/int8 weights with both dims a multiple of 64,
+    # which rules out small heads like RN50's (1, 2048) fc; anything
+    # ineligible stays dense. Returns the list of converted layer names.
+    from torch.ao.pruning import WeightNormSparsifier
+    from torch.sparse import to_sparse_semi_structured
+
+    eligible = [
+        fqn for fqn, module in model.named_modules()
+        if isinstance(module, nn.Linear)
+        and module.weight.size(0) % 64 == 0
+        and module.weight.size(1) % 64 == 0
+    ]
+    if not eligible:
+        return []
+
+    sparse_config = [{"tensor_fqn": f"{fqn}.weight"} for fqn in eligible]
+    sparsifier = WeightNormSparsifier(
+        sparsity_level=0.5,
+        sparse_block_shape=(1, 4),
+        zeros_per_block=2,
+    )
+    sparsifier.prepare(model, sparse_config)
+    sparsifier.step()
+    sparsifier.squash_mask()
+
+    eligible_set = set(eligible)
+    for fqn, module in model.named_modules():
+        if fqn in eligible_set:
+            module.weight = nn.Parameter(to_sparse_semi_structured(module.weight.half()))
+    return eligible
+
+
+def quantize_clip_encoder(model, mode):
+    # Quantize the CLIP image encoder; the fc head stays FP32 (CLIPModel
+    # casts the encoded features back to float before the head). Dynamic
+    # int8 is deliberately not offered: its linear kernels only run on CPU
+    # and this pipeline always moves the model to CUDA for DDP.
+    if mode == 'fp16':
+        # encode_image casts inputs to the visual tower's dtype, so halving
+        # the tower is enough
+        model.model.visual.half()
+    else:
+        raise ValueError(f"Invalid quantization mode: {mode}")
+
+
+def compute_sparsity(model):
+    zeros, total = 0, 0
+    for module in model.modules():
+        if isinstance(module, (nn.Conv2d, nn.Linear)):
+            zeros += torch.sum(module.weight == 0).item()
+            total += module.weight.numel()
+    return zeros / total if total > 0 else 0.0
+
+
+def validate(model, criterion, val_loader, device, gpu_augment, amp_dtype, args):
+    model.eval()
+
+    total_samples = 0
+    running_loss = 0.0
+    y_true, y_pred = [], []
+
+    disable_tqdm = dist.get_rank() != 0
+    loader_with_tqdm = tqdm(val_loader, "Validation", disable=disable_tqdm)
+
+    with torch.inference_mode():
+        for batch_inputs, batch_labels in loader_with_tqdm:
+            batch_inputs = batch_inputs.to(device, non_blocking=True)
+            batch_labels = batch_labels.float().to(device, non_blocking=True)
+
+            if batch_inputs.dim() == 4:
+                batch_inputs = batch_inputs.contiguous(memory_format=torch.channels_last)
+
+            if gpu_augment is not None:
+                batch_inputs = gpu_augment(batch_inputs)
+
+            with torch.cuda.amp.autocast(dtype=amp_dtype):
+                if 'clip' in args.model_name:
+                    outputs = model(batch_inputs, return_all=True).view(-1).unsqueeze(1)
+                else:
+                    outputs = model(batch_inputs).view(-1).unsqueeze(1)
+                loss = criterion(outputs.squeeze(1), batch_labels) / batch_labels.numel()
+
+            total_samples += batch_inputs.size(0)
+            running_loss += loss.item() * batch_inputs.size(0)
+            y_pred.extend(outputs.sigmoid().float().detach().cpu().numpy())
+            y_true.extend(batch_labels.cpu().numpy())
+
+    epoch_loss = running_loss / total_samples
+    y_true, y_pred = np.array(y_true), np.array(y_pred)
+    acc = accuracy_score(y_true, y_pred > 0.5)
+    ap = average_precision_score(y_true, y_pred)
+
+    if dist.get_world_size() > 1:
+        # Each rank only saw its shard of the val set; average metrics
+        metrics = torch.tensor([epoch_loss, acc, ap], device=device)
+        dist.all_reduce(metrics, op=dist.ReduceOp.SUM)
+        metrics /= dist.get_world_size()
+        epoch_loss, acc, ap = metrics.tolist()
+
+    if dist.get_rank() == 0:
+        print(f'Validation Loss: {epoch_loss:.4f} Acc: {acc:.4f} AP: {ap:.4f}')
+
+    return acc
+
+
+def iterative_pruning_finetuning(
+    model,
+    criterion,
+    optimizer,
+    scaler,
+    train_loader,
+    val_loader,
+    device,
+    save_path,
+    pruning_rounds=5,
+    finetune_epochs=2,
+    target_sparsity=0.5,
+    global_prune=False,
+    grad_accum=1,
+    sampler=None,
+    train_gpu_augment=None,
+    val_gpu_augment=None,
+    args=None,
+    ):
+
+    amp_dtype = torch.bfloat16 if args.amp_dtype == 'bfloat16' else torch.float16
+
+    for round_idx in range(pruning_rounds):
+        # Zhu & Gupta-style schedule: each round compounds to the cumulative
+        # sparsity 1-(1-target)^((r+1)/N). Masks are folded at the end of every
+        # round, so pruning sees the full weight again — the folded zeros have
+        # the smallest magnitude and are re-pruned first, which makes the
+        # cumulative amount equivalent to removing a constant relative
+        # fraction of the remaining weights.
+        cumulative_amount = 1 - (1 - target_sparsity) ** ((round_idx + 1) / pruning_rounds)
+
+        if dist.get_rank() == 0:
+            print('\n')
+            print(f'Pruning round {round_idx}/{pruning_rounds} (cumulative sparsity {cumulative_amount:.4f})')
+            print('-' * 10)
+
+        apply_pruning(model.module, cumulative_amount, global_prune)
+
+        if dist.get_rank() == 0:
+            print(f'Sparsity: {compute_sparsity(model.module):.4f}')
+
+        for epoch in range(finetune_epochs):
+            if sampler is not None:
+                sampler.set_epoch(round_idx * finetune_epochs + epoch)
+            model.train()
+
+            total_samples = 0
+            running_loss = 0.0
+            y_true, y_pred = [], []
+
+            disable_tqdm = dist.get_rank() != 0
+            prefetcher = CUDAPrefetcher(train_loader, device)
+            loader_with_tqdm = tqdm(prefetcher, f"Finetuning {epoch}/{finetune_epochs}", total=len(train_loader), disable=disable_tqdm)
+
+            optimizer.zero_grad(set_to_none=True)
+
+            for step, (batch_inputs, batch_labels) in enumerate(loader_with_tqdm):
+                batch_inputs = batch_inputs.to(device, non_blocking=True)
+                batch_labels = batch_labels.float().to(device, non_blocking=True)
+
+                if batch_inputs.dim() == 4:
+                    batch_inputs = batch_inputs.contiguous(memory_format=torch.channels_last)
+
+                if train_gpu_augment is not None:
+                    with torch.no_grad():
+                        batch_inputs = train_gpu_augment(batch_inputs)
+
+                # Only all-reduce gradients on the last micro-step of each
+                # accumulation window; no_sync() skips the NCCL reduction
+                sync_step = (step + 1) % grad_accum == 0 or (step + 1) == len(train_loader)
+                sync_context = nullcontext() if sync_step else model.no_sync()
+
+                with sync_context:
+                    with torch.cuda.amp.autocast(dtype=amp_dtype):
+                        if 'clip' in args.model_name:
+                            outputs = model(batch_inputs, return_all=True).view(-1).unsqueeze(1)
+                        else:
+                            outputs = model(batch_inputs).view(-1).unsqueeze(1)
+                        loss = criterion(outputs.squeeze(1), batch_labels) / batch_labels.numel()
+
+                    scaler.scale(loss / grad_accum).backward()
+
+                if sync_step:
+                    scaler.step(optimizer)
+                    scaler.update()
+                    optimizer.zero_grad(set_to_none=True)
+
+                total_samples += batch_inputs.size(0)
+                running_loss += loss.item() * batch_inputs.size(0)
+                y_pred.extend(outputs.sigmoid().float().detach().cpu().numpy())
+                y_true.extend(batch_labels.cpu().numpy())
+
+            # The loader is sharded per rank, so average over the samples this
+            # rank actually saw, not the full dataset size
+            epoch_loss = running_loss / total_samples
+            y_true, y_pred = np.array(y_true), np.array(y_pred)
+            acc = accuracy_score(y_true, y_pred > 0.5)
+            ap = average_precision_score(y_true, y_pred)
+
+            if dist.get_rank() == 0:
+                print(f'Finetuning Loss: {epoch_loss:.4f} Acc: {acc:.4f} AP: {ap:.4f}')
+
+            validate(model, criterion, val_loader, device, val_gpu_augment, amp_dtype, args)
+
+        # Fold the masks back into the weights so the round's
+        # weight = mask * weight_orig pre-forward hooks disappear and the
+        # containers do not stack across rounds; checkpoints get plain
+        # 'weight' keys. Only the conv/linear leaves carry a mask —
+        # is_pruned() also returns True for their parent modules, which have
+        # no 'weight' to remove.
+        for module in model.module.modules():
+            if isinstance(module, (nn.Conv2d, nn.Linear)) and prune.is_pruned(module):
+                prune.remove(module, 'weight')
+
+        if dist.get_rank() == 0:
+            state = {
+                'round': round_idx,
+                'sparsity': compute_sparsity(model.module),
+                # Unwrap the --compile OptimizedModule so the checkpoint keys
+                # have no _orig_mod. prefix
+                'model_state_dict': getattr(model, '_orig_mod', model).state_dict(),
+                'optimizer_state_dict': optimizer.state_dict(),
+            }
+            torch.save(state, f'{save_path}_round{round_idx}.pth')
+
+    if args.sparsity_pattern == '2:4':
+        converted = apply_semi_structured_sparsity(model.module)
+        if dist.get_rank() == 0:
+            if converted:
+                print(f'Converted to 2:4 semi-structured sparsity: {", ".join(converted)}')
+                torch.save({
+                    'converted_layers': converted,
+                    'model_state_dict': getattr(model, '_orig_mod', model).state_dict(),
+                }, f'{save_path}_2to4.pth')
+            else:
+                print('No linear layers are eligible for 2:4 semi-structured '
+                      'sparsity (both weight dims must be multiples of 64); '
+                      'keeping the unstructured checkpoints')
+
+    return model
+
+
+def main(args):
+
+    seed = 44
+    torch.manual_seed(seed)
+    torch.cuda.manual_seed_all(seed)
+    np.random.seed(seed)
+    random.seed(seed)
+    if args.deterministic:
+        torch.backends.cudnn.deterministic = True
+        torch.backends.cudnn.benchmark = False
+    else:
+        # Let cuDNN pick the fastest conv algorithms and allow TF32 on Ampere+
+        torch.backends.cudnn.benchmark = True
+        torch.backends.cuda.matmul.allow_tf32 = True
+        torch.backends.cudnn.allow_tf32 = True
+
+    device = torch.device(f'cuda:{args.local_rank}')
+    torch.cuda.set_device(device)
+    dist.init_process_group(backend='nccl')
+
+    ratio = args.ratio / 100
+
+    # Set options for augmentation
+    train_opt = {
+        'rz_interp': ['bilinear'],
+        'loadSize': 256,
+        'blur_prob': 0.1,  # Set your value
+        'blur_sig': [0.0, 3.0],
+        'jpg_prob': 0.1,  # Set your value
+        'jpg_method': ['cv2', 'pil'],
+        'jpg_qual': [30, 100]
+    }
+
+    val_opt = {
+        'rz_interp': ['bilinear'],
+        'loadSize': 256,
+        'blur_prob': 0.1,  # Set your value
+        'blur_sig': [(0.0 + 3.0) / 2],
+        'jpg_prob': 0.1,  # Set your value
+        'jpg_method': ['pil'],
+        'jpg_qual': [int((30 + 100) / 2)]
+    }
+
+    if args.model_name == 'clip':
+        norm_mean = (0.48145466, 0.4578275, 0.40821073)
+        norm_std = (0.26862954, 0.26130258, 0.27577711)
+    else:
+        norm_mean = (0.485, 0.456, 0.406)
+        norm_std = (0.229, 0.224, 0.225)
+
+    # Create a batched GPU MaskGenerator
+    if args.mask_type == 'spectral':
+        gpu_mask = FrequencyMaskGPU(ratio=ratio, band=args.band)
+    elif args.mask_type == 'pixel':
+        gpu_mask = PixelMaskGPU(ratio=ratio)
+    elif args.mask_type == 'patch':
+        gpu_mask = PatchMaskGPU(ratio=ratio)
+    else:
+        gpu_mask = None
+
+    train_transform = base_augment(train_opt, args)
+    val_transform = base_augment(val_opt, args)
+    train_gpu_augment = GPUAugment(
+        train_opt, mask=gpu_mask, mean=norm_mean, std=norm_std, train=True).to(device)
+    val_gpu_augment = GPUAugment(
+        val_opt, mask=gpu_mask, mean=norm_mean, std=norm_std, train=False).to(device)
+
+    # Load the dataset from directories
+    train_data = datasets.ImageFolder(root='/home/users/chandler_doloriel/scratch/Datasets/CIFAKE/train', transform=train_transform)
+    train_sampler = DistributedSampler(train_data, shuffle=True, seed=seed)
+    train_loader = DataLoader(train_data, batch_size=args.batch_size, sampler=train_sampler, num_workers=4,
+                              pin_memory=True, persistent_workers=True, prefetch_factor=args.prefetch_factor)
+    val_data = datasets.ImageFolder(root='/home/users/chandler_doloriel/scratch/Datasets/CIFAKE/test', transform=val_transform)
+    # Shard validation across ranks; metrics are all-reduced in validate()
+    val_sampler = DistributedSampler(val_data, shuffle=False)
+    val_loader = DataLoader(val_data, batch_size=args.batch_size, sampler=val_sampler, num_workers=4,
+                            pin_memory=True, persistent_workers=True, prefetch_factor=args.prefetch_factor)
+
+    if args.model_name == 'RN50':
+        model = resnet50(pretrained=args.pretrained)
+        model.fc = nn.Linear(model.fc.in_features, 1)
+    elif args.model_name == 'RN50_mod':
+        model = _resnet50(pretrained=args.pretrained, stride0=1)
+        model.fc = ChannelLinear(model.fc.in_features, 1)
+    elif args.model_name.startswith('clip_vitl14'):
+        model = CLIPModel('ViT-L/14', num_classes=1, clip_grad=True)
+    elif args.model_name.startswith('clip_rn50'):
+        model = CLIPModel('RN50', num_classes=1, clip_grad=True)
+    else:
+        raise ValueError(f"Model {args.model_name} not recognized!")
+
+    if 'clip' in args.model_name and args.quantize_encoder != 'none':
+        quantize_clip_encoder(model, args.quantize_encoder)
+
+    model = model.to(device, memory_format=torch.channels_last)
+    # Larger buckets raise NCCL all-reduce throughput; no static_graph here
+    # because the fine-tune loop relies on no_sync() for accumulation
+    model = DistributedDataParallel(
+        model,
+        device_ids=[args.local_rank],
+        output_device=args.local_rank,
+        bucket_cap_mb=args.bucket_cap_mb,
+        gradient_as_bucket_view=True,
+        )
+
+    # reduction='sum' skips the mean's extra division kernel; the fine-tune
+    # loop divides by the batch size on the host instead
+    criterion = nn.BCEWithLogitsLoss(reduction='sum')
+    # fused=True updates all parameter tensors in a single CUDA kernel
+    optimizer = torch.optim.AdamW(model.parameters(), lr=args.lr, betas=(0.9, 0.999), weight_decay=1e-4,
+                                  **adamw_fused_kwargs())
+    # BF16 does not need loss scaling; only enable the scaler for FP16
+    scaler = torch.cuda.amp.GradScaler(enabled=(args.amp_dtype == 'float16'))
+
+    if args.checkpoint_path:
+        checkpoint = torch_load_cpu(args.checkpoint_path)
+        model.load_state_dict(checkpoint['model_state_dict'])
+        if dist.get_rank() == 0:
+            print(f"\nLoaded checkpoint {args.checkpoint_path}")
+
+    if args.compile:
+        # Compile only after the checkpoint load: the OptimizedModule wrapper
+        # prefixes state-dict keys with _orig_mod., so loading a normally
+        # saved checkpoint into a compiled model fails strict key matching.
+        # Masked weights are recomputed by the pruning hooks each forward, so
+        # one compile up front still covers every round
+        model = torch.compile(model, mode='max-autotune', fullgraph=False)
+
+    iterative_pruning_finetuning(
+        model,
+        criterion,
+        optimizer,
+        scaler,
+        train_loader,
+        val_loader,
+        device,
+        save_path=args.save_path,
+        pruning_rounds=args.pruning_rounds,
+        finetune_epochs=args.finetune_epochs,
+        target_sparsity=args.target_sparsity,
+        global_prune=args.global_prune,
+        grad_accum=args.grad_accum,
+        sampler=train_sampler,
+        train_gpu_augment=train_gpu_augment,
+        val_gpu_augment=val_gpu_augment,
+        args=args,
+        )
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Iterative magnitude pruning + fine-tuning")
+
+    parser.add_argument('--local_rank', type=int, default=0, help='Local rank for distributed training')
+    parser.add_argument(
+        '--model_name',
+        default='RN50',
+        type=str,
+        choices=[
+            'RN50', 'RN50_mod', 'clip_vitl14', 'clip_rn50'
+        ],
+        help='Type of model to prune'
+        )
+    parser.add_argument(
+        '--band',
+        default='all',
+        type=str,
+        choices=[
+            'all', 'low', 'mid', 'high',
+        ]
+        )
+    parser.add_argument(
+        '--pretrained',
+        action='store_true',
+        help='For pretraining'
+        )
+    parser.add_argument(
+        '--deterministic',
+        action='store_true',
+        help='Deterministic cuDNN (disables benchmark mode and TF32)'
+        )
+    parser.add_argument(
+        '--compile',
+        action='store_true',
+        help='Compile the model with torch.compile (requires PyTorch 2.x)'
+        )
+    parser.add_argument(
+        '--mask_type',
+        default='spectral',
+        choices=[
+            'pixel',
+            'spectral',
+            'patch',
+            'nomask'],
+        help='Type of mask generator'
+        )
+    parser.add_argument(
+        '--checkpoint_path',
+        type=str,
+        default=None,
+        help='Trained checkpoint to prune'
+        )
+    parser.add_argument(
+        '--pruning_rounds',
+        type=int,
+        default=5,
+        help='Number of prune + fine-tune rounds'
+        )
+    parser.add_argument(
+        '--finetune_epochs',
+        type=int,
+        default=2,
+        help='Fine-tune epochs per pruning round'
+        )
+    parser.add_argument(
+        '--target_sparsity',
+        type=float,
+        default=0.5,
+        help='Overall sparsity reached after all pruning rounds'
+        )
+    parser.add_argument(
+        '--grad_accum',
+        type=int,
+        default=1,
+        help='Micro-steps per optimizer step; DDP only syncs on the last one'
+        )
+    parser.add_argument(
+        '--global_prune',
+        action='store_true',
+        help='Prune globally across layers instead of per layer'
+        )
+    parser.add_argument(
+        '--quantize_encoder',
+        default='none',
+        type=str,
+        choices=['none', 'fp16'],
+        help='Quantize the CLIP image encoder'
+        )
+    parser.add_argument(
+        '--sparsity_pattern',
+        default='unstructured',
+        type=str,
+        choices=['unstructured', '2:4'],
+        help='Convert pruned weights to 2:4 semi-structured sparsity for sparse Tensor Cores'
+        )
+    parser.add_argument(
+        '--amp_dtype',
+        default='bfloat16',
+        type=str,
+        choices=['bfloat16', 'float16'],
+        help='Autocast dtype for the fine-tune loop'
+        )
+    parser.add_argument(
+        '--batch_size',
+        type=int,
+        default=64,
+        help='Batch Size'
+        )
+    parser.add_argument(
+        '--ratio',
+        type=int,
+        default=50,
+        help='Masking ratio'
+        )
+    parser.add_argument(
+        '--lr',
+        type=float,
+        default=0.0001,
+        help='learning rate'
+        )
+    parser.add_argument(
+        '--prefetch_factor',
+        type=int,
+        default=4,
+        help='Batches prefetched per DataLoader worker'
+        )
+    parser.add_argument(
+        '--bucket_cap_mb',
+        type=int,
+        default=50,
+        help='DDP gradient bucket size in MB'
+        )
+
+    args = parser.parse_args()
+    model_name = args.model_name.lower().replace('/', '').replace('-', '')
+
+    ckpt_folder = './checkpoints/pruned'
+    os.makedirs(ckpt_folder, exist_ok=True)
+    args.save_path = f'{ckpt_folder}/{model_name}_{args.mask_type}mask'
+
+    # Pretty print the arguments
+    print("\nSelected Configuration:")
+    print("-" * 30)
+    print(f"Model type: {args.model_name}")
+    print(f"Mask Generator Type: {args.mask_type}")
+    print(f"Mask Ratio: {args.ratio}")
+    print(f"Batch Size: {args.batch_size}")
+    print(f"Pruning rounds: {args.pruning_rounds}")
+    print(f"Finetune epochs per round: {args.finetune_epochs}")
+    print(f"Target sparsity: {args.target_sparsity}")
+    print(f"Global pruning: {args.global_prune}")
+    print(f"Sparsity pattern: {args.sparsity_pattern}")
+    print(f"Autocast dtype: {args.amp_dtype}")
+    print(f"Checkpoint: {args.checkpoint_path}")
+    print(f"Save path: {args.save_path}")
+    print("-" * 30, "\n")
+
+    main(args)
+
+
+# How to run?
+# python -m torch.distributed.launch --nproc_per_node=2 pruning.py -- --args.parse
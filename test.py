@@ -89,6 +89,11 @@ if __name__ == "__main__":
         action='store_true', 
         help='if the model is from my own code'
         )
+    parser.add_argument(
+        '--deterministic',
+        action='store_true',
+        help='Deterministic cuDNN (disables benchmark mode and TF32)'
+        )
     parser.add_argument('--local_rank', type=int, default=0, help='Local rank for distributed training')
 
     args = parser.parse_args()
@@ -98,8 +103,14 @@ if __name__ == "__main__":
     torch.cuda.manual_seed_all(seed)
     np.random.seed(seed)
     random.seed(seed)
-    torch.backends.cudnn.deterministic = True
-    torch.backends.cudnn.benchmark = False
+    if args.deterministic:
+        torch.backends.cudnn.deterministic = True
+        torch.backends.cudnn.benchmark = False
+    else:
+        # Let cuDNN pick the fastest conv algorithms and allow TF32 on Ampere+
+        torch.backends.cudnn.benchmark = True
+        torch.backends.cuda.matmul.allow_tf32 = True
+        torch.backends.cudnn.allow_tf32 = True
 
     device = torch.device(f'cuda:{args.local_rank}')
     torch.cuda.set_device(device)
@@ -2,7 +2,7 @@
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from torch.utils.data import DataLoader, TensorDataset, Subset
+from torch.utils.data import DataLoader, TensorDataset
 from torchvision import transforms, datasets
 from tqdm import tqdm
 import numpy as np
@@ -16,10 +16,12 @@ import torch.distributed as dist
 from torch.nn.parallel import DistributedDataParallel
 from torch.utils.data.distributed import DistributedSampler
 
-from dataset import ForenSynths
+from dataset import ForenSynths, RoundRobinIterable
 # from extract_features import *
-from augment import ImageAugmentor
+from augment import ImageAugmentor, GPUAugment
 from mask import *
+from mask_gpu import FrequencyMaskGPU, PixelMaskGPU, PatchMaskGPU
+from dali_pipeline import create_dali_loader
 from earlystop import EarlyStopping
 from utils import *
 from networks.resnet import resnet50
@@ -60,8 +62,14 @@ def main(
     torch.cuda.manual_seed_all(seed)
     np.random.seed(seed)
     random.seed(seed)
-    torch.backends.cudnn.deterministic = True
-    torch.backends.cudnn.benchmark = False
+    if args.deterministic:
+        torch.backends.cudnn.deterministic = True
+        torch.backends.cudnn.benchmark = False
+    else:
+        # Let cuDNN pick the fastest conv algorithms and allow TF32 on Ampere+
+        torch.backends.cudnn.benchmark = True
+        torch.backends.cuda.matmul.allow_tf32 = True
+        torch.backends.cudnn.allow_tf32 = True
 
     device = torch.device(f'cuda:{local_rank}')
     torch.cuda.set_device(device)
@@ -97,19 +105,32 @@ def main(
 
     if ratio > 1.0 or ratio < 0.0:
         raise valueError(f"Invalid mask ratio {ratio}")
+
+    if args.model_name == 'clip':
+        norm_mean = (0.48145466, 0.4578275, 0.40821073)
+        norm_std = (0.26862954, 0.26130258, 0.27577711)
     else:
-        # Create a MaskGenerator
-        if mask_type == 'spectral':
-            mask_generator = FrequencyMaskGenerator(ratio=ratio, band=band)
-        elif mask_type == 'pixel':
-            mask_generator = PixelMaskGenerator(ratio=ratio)
-        elif mask_type == 'patch':
-            mask_generator = PatchMaskGenerator(ratio=ratio)
-        else:
-            mask_generator = None
+        norm_mean = (0.485, 0.456, 0.406)
+        norm_std = (0.229, 0.224, 0.225)
+
+    # Create a batched GPU MaskGenerator
+    if mask_type == 'spectral':
+        gpu_mask = FrequencyMaskGPU(ratio=ratio, band=band)
+    elif mask_type == 'pixel':
+        gpu_mask = PixelMaskGPU(ratio=ratio)
+    elif mask_type == 'patch':
+        gpu_mask = PatchMaskGPU(ratio=ratio)
+    else:
+        gpu_mask = None
 
-    train_transform = train_augment(ImageAugmentor(train_opt), mask_generator, args)
-    val_transform = val_augment(ImageAugmentor(val_opt), mask_generator, args)
+    # Masking and blur/crop/flip run batched on the GPU, so the workers only
+    # decode, resize and convert to tensors
+    train_transform = base_augment(train_opt, args)
+    val_transform = base_augment(val_opt, args)
+    train_gpu_augment = GPUAugment(
+        train_opt, mask=gpu_mask, mean=norm_mean, std=norm_std, train=True).to(device)
+    val_gpu_augment = GPUAugment(
+        val_opt, mask=gpu_mask, mean=norm_mean, std=norm_std, train=False).to(device)
 
 
     # # Creating training dataset from images
@@ -128,12 +149,53 @@ def main(
     # val_loader = DataLoader(val_data, batch_size=batch_size, shuffle=False, num_workers=4)
 
 
-    # Load the dataset from directories 
-    train_data = datasets.ImageFolder(root='/home/users/chandler_doloriel/scratch/Datasets/CIFAKE/train', transform=train_transform)
-    train_sampler = DistributedSampler(train_data, shuffle=True, seed=seed)
-    train_loader = DataLoader(train_data, batch_size=batch_size, sampler=train_sampler, num_workers=4)
-    val_data = datasets.ImageFolder(root='/home/users/chandler_doloriel/scratch/Datasets/CIFAKE/test', transform=val_transform)
-    val_loader = DataLoader(val_data, batch_size=batch_size, shuffle=False, num_workers=4)
+    # Load the dataset from directories
+    if args.loader == 'dali':
+        # nvJPEG decodes and resizes on the GPU; DALI shards and shuffles
+        # internally, so there is no DistributedSampler to set_epoch on
+        train_loader = create_dali_loader(
+            '/home/users/chandler_doloriel/scratch/Datasets/CIFAKE/train',
+            batch_size, 4, local_rank, train_opt['loadSize'], training=True,
+            shard_id=dist.get_rank(), num_shards=dist.get_world_size(), seed=seed,
+            jpg_prob=train_opt['jpg_prob'], jpg_qual=train_opt['jpg_qual'])
+        val_loader = create_dali_loader(
+            '/home/users/chandler_doloriel/scratch/Datasets/CIFAKE/test',
+            batch_size, 4, local_rank, val_opt['loadSize'], training=False,
+            shard_id=dist.get_rank(), num_shards=dist.get_world_size(),
+            jpg_prob=val_opt['jpg_prob'], jpg_qual=val_opt['jpg_qual'])
+        train_sampler = None
+    else:
+        train_data = datasets.ImageFolder(root='/home/users/chandler_doloriel/scratch/Datasets/CIFAKE/train', transform=train_transform)
+        if args.round_robin:
+            # Items are sharded one-by-one across workers; the iterable also
+            # shuffles and shards across ranks, and train_model calls its
+            # set_epoch, so it stands in for the DistributedSampler.
+            # persistent_workers stays off so workers see each reshuffle.
+            train_data = RoundRobinIterable(train_data, shuffle=True, seed=seed,
+                                            rank=dist.get_rank(), world_size=dist.get_world_size())
+            train_sampler = train_data
+            train_loader = DataLoader(train_data, batch_size=batch_size, num_workers=4,
+                                      pin_memory=True, prefetch_factor=args.prefetch_factor)
+        else:
+            # drop_last in debug mode makes the sampler truncate the index
+            # list to total_size; with the default padding branch the
+            # shrunken counts below would make padding_size negative and
+            # trip the sampler's length assert
+            train_sampler = DistributedSampler(train_data, shuffle=True, seed=seed, drop_last=args.debug)
+            if args.debug:
+                # Shrink the per-rank epoch instead of wrapping train_data in
+                # a Subset: no extra __getitem__ indirection, and the sampler
+                # seed keeps the ranks' draws consistent
+                world_size = dist.get_world_size()
+                train_sampler.num_samples = max(1, int(0.02 * len(train_data)) // world_size)
+                train_sampler.total_size = train_sampler.num_samples * world_size
+            train_loader = DataLoader(train_data, batch_size=batch_size, sampler=train_sampler, num_workers=4,
+                                      pin_memory=True, persistent_workers=True, prefetch_factor=args.prefetch_factor)
+        val_data = datasets.ImageFolder(root='/home/users/chandler_doloriel/scratch/Datasets/CIFAKE/test', transform=val_transform)
+        # Shard validation across ranks; metrics are all-reduced in train_model
+        val_sampler = DistributedSampler(val_data, shuffle=False)
+        val_loader = DataLoader(val_data, batch_size=batch_size, sampler=val_sampler, num_workers=4,
+                                pin_memory=True, persistent_workers=True, prefetch_factor=args.prefetch_factor)
 
 
     # Creating and training the binary classifier
@@ -154,12 +216,24 @@ def main(
     else:
         raise ValueError(f"Model {model_name} not recognized!")
 
-    model = model.to(device)
-    model = DistributedDataParallel(model)
-    # model = DistributedDataParallel(model, find_unused_parameters=True)
+    model = model.to(device, memory_format=torch.channels_last)
+    # Larger buckets raise NCCL all-reduce throughput; gradient_as_bucket_view
+    # skips the grad->bucket copy and static_graph improves backward overlap
+    model = DistributedDataParallel(
+        model,
+        device_ids=[local_rank],
+        output_device=local_rank,
+        bucket_cap_mb=args.bucket_cap_mb,
+        gradient_as_bucket_view=True,
+        static_graph=True,
+        )
 
-    criterion = nn.BCEWithLogitsLoss()
-    optimizer = torch.optim.AdamW(model.parameters(), lr=args.lr, betas=(0.9, 0.999), weight_decay=1e-4) 
+    # reduction='sum' skips the mean's extra division kernel; the training
+    # loop divides by the batch size on the host instead
+    criterion = nn.BCEWithLogitsLoss(reduction='sum')
+    # fused=True updates all parameter tensors in a single CUDA kernel
+    optimizer = torch.optim.AdamW(model.parameters(), lr=args.lr, betas=(0.9, 0.999), weight_decay=1e-4,
+                                  **adamw_fused_kwargs())
 
     # Load checkpoint if resuming
     if resume_train:
@@ -178,7 +252,7 @@ def main(
         else:
             raise ValueError("No matching checkpoint files found.")
 
-        checkpoint = torch.load(checkpoint_path)
+        checkpoint = torch_load_cpu(checkpoint_path)
         if 'clip' in args.model_name:
             model.module.fc.load_state_dict(checkpoint['model_state_dict'])
         else:
@@ -199,6 +273,12 @@ def main(
         best_score = None
         counter=0
 
+    if args.compile:
+        # Compile only after any checkpoint load: the OptimizedModule wrapper
+        # prefixes state-dict keys with _orig_mod., so loading a normally
+        # saved checkpoint into a compiled model fails strict key matching
+        model = torch.compile(model, mode='max-autotune', fullgraph=False)
+
     early_stopping = EarlyStopping(
         path=save_path, 
         patience=5, 
@@ -224,6 +304,8 @@ def main(
         early_stopping=early_stopping,
         device=device,
         sampler=train_sampler,
+        train_gpu_augment=train_gpu_augment,
+        val_gpu_augment=val_gpu_augment,
         args=args,
         )
         
@@ -292,10 +374,20 @@ if __name__ == "__main__":
         help='For early stopping'
         )
     parser.add_argument(
-        '--debug', 
-        action='store_true', 
+        '--debug',
+        action='store_true',
         help='For debugging'
         )
+    parser.add_argument(
+        '--deterministic',
+        action='store_true',
+        help='Deterministic cuDNN (disables benchmark mode and TF32)'
+        )
+    parser.add_argument(
+        '--compile',
+        action='store_true',
+        help='Compile the model with torch.compile (requires PyTorch 2.x)'
+        )
     parser.add_argument(
         '--clip_grad', 
         action='store_true', 
@@ -324,11 +416,35 @@ if __name__ == "__main__":
         help='Masking ratio'
         )
     parser.add_argument(
-        '--lr', 
-        type=float, 
-        default=0.0001, 
+        '--lr',
+        type=float,
+        default=0.0001,
         help='learning rate'
         )
+    parser.add_argument(
+        '--prefetch_factor',
+        type=int,
+        default=4,
+        help='Batches prefetched per DataLoader worker'
+        )
+    parser.add_argument(
+        '--bucket_cap_mb',
+        type=int,
+        default=50,
+        help='DDP gradient bucket size in MB'
+        )
+    parser.add_argument(
+        '--loader',
+        default='pytorch',
+        type=str,
+        choices=['pytorch', 'dali'],
+        help='Data loading backend; dali decodes JPEGs on the GPU'
+        )
+    parser.add_argument(
+        '--round_robin',
+        action='store_true',
+        help='Round-robin individual samples across DataLoader workers'
+        )
 
     args = parser.parse_args()
     model_name = args.model_name.lower().replace('/', '').replace('-', '')
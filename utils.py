@@ -1,4 +1,6 @@
 
+import inspect
+import pickle
 import torch
 import os
 import torch.nn as nn
@@ -30,6 +32,79 @@ from torch.utils.data.distributed import DistributedSampler
 os.environ['NCCL_BLOCKING_WAIT'] = '1'
 os.environ['NCCL_DEBUG'] = 'WARN'
 
+class CUDAPrefetcher:
+    """Iterates a DataLoader while copying the next batch host-to-device on a
+    dedicated CUDA stream, so the PCIe transfer overlaps with compute. The
+    loader should be built with pin_memory=True for the copies to be async."""
+
+    def __init__(self, loader, device):
+        self.loader = loader
+        self.device = device
+        self.stream = torch.cuda.Stream(device=device)
+
+    def __len__(self):
+        return len(self.loader)
+
+    @property
+    def dataset(self):
+        return self.loader.dataset
+
+    def __iter__(self):
+        inputs = labels = None
+        for next_inputs, next_labels in self.loader:
+            with torch.cuda.stream(self.stream):
+                next_inputs = next_inputs.to(self.device, non_blocking=True)
+                next_labels = next_labels.to(self.device, non_blocking=True)
+            if inputs is not None:
+                yield inputs, labels
+            # Make the main stream wait for the copy before using the batch,
+            # and mark the batch as in use on the main stream so the caching
+            # allocator does not recycle its memory for a later copy on the
+            # side stream while the main stream is still reading it
+            torch.cuda.current_stream(self.device).wait_stream(self.stream)
+            inputs, labels = next_inputs, next_labels
+            inputs.record_stream(torch.cuda.current_stream(self.device))
+            labels.record_stream(torch.cuda.current_stream(self.device))
+        if inputs is not None:
+            yield inputs, labels
+
+
+def adamw_fused_kwargs():
+    # The fused CUDA AdamW kernel and its kwarg only exist from torch 2.0;
+    # gate on the signature so older builds just get the default impl
+    if torch.cuda.is_available() and 'fused' in inspect.signature(torch.optim.AdamW.__init__).parameters:
+        return {'fused': True}
+    return {}
+
+
+def torch_load_cpu(path):
+    # torch.load with mmap (avoids reading the whole file into RSS) and
+    # weights_only (skips unpickling arbitrary Python objects). Both kwargs
+    # need torch >= 2.1, so fall back to a plain CPU load on older runtimes.
+    # Pre-existing checkpoints store best_score as a numpy scalar, which the
+    # weights-only unpickler rejects; these are our own trusted files, so
+    # retry without the restriction rather than fail the load
+    try:
+        return torch.load(path, map_location='cpu', mmap=True, weights_only=True)
+    except TypeError:
+        return torch.load(path, map_location='cpu')
+    except pickle.UnpicklingError:
+        return torch.load(path, map_location='cpu', mmap=True, weights_only=False)
+
+
+def base_augment(opt, args=None):
+    # Minimal CPU-side pipeline for when the batched augmentation runs on
+    # GPU. JPEG re-compression stays here: it is a byte-level encode/decode
+    # with no batched GPU equivalent, and at jpg_prob it only touches a small
+    # fraction of samples. Blur is zeroed out because GPUAugment applies it
+    # on the device
+    augmentor = ImageAugmentor({**opt, 'blur_prob': 0.0})
+    return transforms.Compose([
+        transforms.Resize(opt['loadSize']),
+        transforms.Lambda(lambda img: augmentor.data_augment(img)),
+        transforms.ToTensor(),
+    ])
+
 def train_augment(augmentor, mask_generator=None, args=None):
     transform_list = []
     if mask_generator is not None:
@@ -90,6 +165,8 @@ def train_model(
     early_stopping=None,
     device='cpu',
     sampler=None,
+    train_gpu_augment=None,
+    val_gpu_augment=None,
     args=None,
     ):
 
@@ -105,10 +182,16 @@ def train_model(
 
         # For CLIP model, extract features only once
         if 'clip' in args.model_name and not features_exist and args.clip_grad == False:
-            # Process with rank 0 performs the extraction
+            # Process with rank 0 performs the extraction. The training and
+            # validation loaders are sharded across ranks, so iterate fresh
+            # unsharded loaders here — otherwise only rank 0's 1/world_size
+            # shard of each set would be cached
             if dist.get_rank() == 0:
-                extract_and_save_features(model, train_loader, "./clip_train_" + features_path, device)
-                extract_and_save_features(model, val_loader, "./clip_val_" + features_path, device)
+                train_dataset = getattr(train_loader.dataset, 'dataset', train_loader.dataset)
+                full_train_loader = DataLoader(train_dataset, batch_size=args.batch_size, shuffle=False, num_workers=4, pin_memory=True)
+                full_val_loader = DataLoader(val_loader.dataset, batch_size=args.batch_size, shuffle=False, num_workers=4, pin_memory=True)
+                extract_and_save_features(model, full_train_loader, "./clip_train_" + features_path, device, gpu_augment=train_gpu_augment)
+                extract_and_save_features(model, full_val_loader, "./clip_val_" + features_path, device, gpu_augment=val_gpu_augment)
                 # Create a temporary file to signal completion
                 with open(f'clip_extract.done', 'w') as f:
                     f.write('done')
@@ -130,6 +213,9 @@ def train_model(
             os.remove("./clip_val_" + features_path)
             os.remove("clip_extract.done")
 
+            # Loaders now yield pre-extracted features, not images
+            train_gpu_augment = val_gpu_augment = None
+
         for phase in ['Training', 'Validation']:
             if phase == 'Training':
                 if sampler is not None:
@@ -140,32 +226,47 @@ def train_model(
                 model.eval()
                 data_loader = val_loader
 
-            total_samples = len(data_loader.dataset)
+            total_samples = 0
             running_loss = 0.0
             y_true, y_pred = [], []
 
             disable_tqdm = dist.get_rank() != 0
             data_loader_with_tqdm = tqdm(data_loader, f"{phase}", disable=disable_tqdm)
 
+            gpu_augment = train_gpu_augment if phase == 'Training' else val_gpu_augment
+
             for batch_data in data_loader_with_tqdm:
                 batch_inputs, batch_labels = batch_data
-                batch_inputs = batch_inputs.to(device)
-                batch_labels = batch_labels.float().to(device)
+                batch_inputs = batch_inputs.to(device, non_blocking=True)
+                batch_labels = batch_labels.float().to(device, non_blocking=True)
+
+                if batch_inputs.dim() == 4:
+                    # Match the channels-last layout of the model so cuDNN can
+                    # use NHWC Tensor-Core conv kernels
+                    batch_inputs = batch_inputs.contiguous(memory_format=torch.channels_last)
+
+                if gpu_augment is not None:
+                    with torch.no_grad():
+                        batch_inputs = gpu_augment(batch_inputs)
 
-                optimizer.zero_grad()
+                optimizer.zero_grad(set_to_none=True)
 
-                with torch.set_grad_enabled(phase == 'Training'):
+                # inference_mode skips autograd bookkeeping entirely during val
+                grad_context = torch.enable_grad() if phase == 'Training' else torch.inference_mode()
+
+                with grad_context:
                     if 'clip' in args.model_name and args.clip_grad == True:
                         outputs = model(batch_inputs, return_all=True).view(-1).unsqueeze(1)
                     else:
                         outputs = model(batch_inputs).view(-1).unsqueeze(1) # pass the input to the fc layer only
 
-                    loss = criterion(outputs.squeeze(1), batch_labels)
+                    loss = criterion(outputs.squeeze(1), batch_labels) / batch_labels.numel()
 
                     if phase == 'Training':
                         loss.backward()
                         optimizer.step()
 
+                total_samples += batch_inputs.size(0)
                 running_loss += loss.item() * batch_inputs.size(0)
                 y_pred.extend(outputs.sigmoid().detach().cpu().numpy())
                 y_true.extend(batch_labels.cpu().numpy())
@@ -176,6 +277,13 @@ def train_model(
             acc = accuracy_score(y_true, y_pred > 0.5)
             ap = average_precision_score(y_true, y_pred)
 
+            if phase == 'Validation' and dist.is_initialized() and dist.get_world_size() > 1:
+                # Each rank only saw its shard of the val set; average metrics
+                metrics = torch.tensor([epoch_loss, acc, ap], device=device)
+                dist.all_reduce(metrics, op=dist.ReduceOp.SUM)
+                metrics /= dist.get_world_size()
+                epoch_loss, acc, ap = metrics.tolist()
+
             if epoch % 1 == 0:  # Only print every epoch
                 if dist.get_rank() == 0:
                     print(f'{phase} Loss: {epoch_loss:.4f} Acc: {acc:.4f} AP: {ap:.4f}')
@@ -239,7 +347,7 @@ def evaluate_model(
         raise ValueError("wrong dataset input")
 
     test_sampler = DistributedSampler(test_dataset)
-    test_dataloader = DataLoader(test_dataset, batch_size=batch_size, sampler=test_sampler, shuffle=False, num_workers=4)
+    test_dataloader = DataLoader(test_dataset, batch_size=batch_size, sampler=test_sampler, shuffle=False, num_workers=4, pin_memory=True)
 
     if model_name == 'RN50':
         # model = vis_models.resnet50(pretrained=pretrained)
@@ -264,7 +372,7 @@ def evaluate_model(
     model = model.to(device)
     model = DistributedDataParallel(model, find_unused_parameters=True)
 
-    checkpoint = torch.load(checkpoint_path)
+    checkpoint = torch_load_cpu(checkpoint_path)
 
     if 'clip' in args.model_name and args.other_model != True and args.clip_ft == False:
         model.module.fc.load_state_dict(checkpoint['model_state_dict'])
@@ -306,7 +414,7 @@ def evaluate_model(
     return ap, acc, auc
 
 
-def extract_and_save_features(model, data_loader, save_path, device='cpu'):
+def extract_and_save_features(model, data_loader, save_path, device='cpu', gpu_augment=None):
     model.eval()
     features = []
     labels_list = []
@@ -317,6 +425,8 @@ def extract_and_save_features(model, data_loader, save_path, device='cpu'):
     with torch.no_grad():
         for inputs, labels in data_loader_with_tqdm:
             inputs = inputs.to(device)
+            if gpu_augment is not None:
+                inputs = gpu_augment(inputs)
             features.append(model(inputs, return_feature=True).detach().cpu())
             labels_list.append(labels)
 
@@ -325,6 +435,6 @@ def extract_and_save_features(model, data_loader, save_path, device='cpu'):
     torch.save((features, labels), save_path)
 
 def load_features(save_path, batch_size=32, shuffle=True):
-    features, labels = torch.load(save_path)
+    features, labels = torch_load_cpu(save_path)
     dataset = TensorDataset(features, labels)
     return DataLoader(dataset, batch_size=batch_size, shuffle=shuffle)
\ No newline at end of file